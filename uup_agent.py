@@ -1,14 +1,15 @@
 import json
 import re
-from typing import Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
 from langchain.prompts import PromptTemplate, ChatPromptTemplate, FewShotChatMessagePromptTemplate
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.prompts.example_selector import SemanticSimilarityExampleSelector
-from langchain.schema.runnable import RunnableLambda
 from langchain.schema.output_parser import StrOutputParser
 from langchain_google_genai import ChatGoogleGenerativeAI
-from operator import itemgetter
 from pymongo import MongoClient
 from uup_config import Config
 
@@ -26,7 +27,14 @@ class MongoAgent:
             google_api_key=self.config.GOOGLE_API_KEY,
             temperature=0.001,
         )
+        # Critical-path stages and speculative warm-ups get separate pools so
+        # warm-ups from concurrent requests never delay another query's context.
+        self.stage_executor = ThreadPoolExecutor(max_workers=self.config.STAGE_WORKERS)
+        self.stage_slots = threading.BoundedSemaphore(self.config.STAGE_WORKERS)
+        self.warm_executor = ThreadPoolExecutor(max_workers=self.config.WARM_WORKERS)
         self._setup_prompts()
+        self.fields_description = self.get_collection_details()
+        self.warm_fields = ['Date', 'Mode_of_Payment', 'Merchant', 'Categories', 'Amount_credited', 'Amount_debited']
     
     def _setup_prompts(self):
         self.generate_query_template = '''You are a AI agent which is proficient with the MongoDB database.
@@ -74,15 +82,6 @@ If there's an error, explain what went wrong in simple terms.
 If user has question about the month and if in query result if you get the month referring in number you have to convert them back into their name like January, February and other.
 The transaction amount is in Indian Rupees (INR) currency.
 
-Response:"""
-        )
-
-        self.chat_prompt = PromptTemplate(
-            input_variables=["question"],
-            template="""You are a helpful assistant that will assist the user in querying about their transaction documents uploaded by them. You have to answer their question in a polite and helpful manner.
-
-Original Question: {question}
-
 Response:"""
         )
 
@@ -498,42 +497,120 @@ Response:"""
 
         return output
     
-    def process_query(self, question: str, user_item: str) -> str:
+    def select_examples(self, question: str) -> str:
+        return self.few_shot_prompt.format(input=question)
+
+    def warm_user_working_set(self, user_item: str):
+        # Generated queries always match on user.item and then scan, sort or
+        # group the user's transactions, so read that same set by Date.
+        try:
+            projection = {field: 1 for field in self.warm_fields}
+            cursor = self.source_collection.find({"user.item": user_item}, projection).sort("Date", -1)
+            for _ in cursor:
+                pass
+        except Exception as e:
+            print(f"Error warming user working set: {e}")
+
+    def _run_stage(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    def _submit_stage(self, func, *args):
+        # Run inline when every stage worker is busy; queueing behind other
+        # requests would be slower than the serial path.
+        if not self.stage_slots.acquire(blocking=False):
+            return None
+        future = self.stage_executor.submit(self._run_stage, func, *args)
+        future.add_done_callback(lambda _: self.stage_slots.release())
+        return future
+
+    def _generate(self, generate_chain, inputs: Dict, user_item: str):
+        # Stream the generation and start the warm-up as soon as the output
+        # looks like a JSON query; chat replies never touch Mongo.
+        chunks = []
+        warm_future = None
+        for chunk in generate_chain.stream(inputs):
+            chunks.append(chunk)
+            if warm_future is None:
+                head = "".join(chunks).lstrip()
+                if head.startswith(("{", "`")):
+                    warm_future = self.warm_executor.submit(self._run_stage, self.warm_user_working_set, user_item)
+        return "".join(chunks), warm_future
+
+    def _record_warm(self, timings: Dict, warm_future):
+        if warm_future is None or 'warm' in timings:
+            return
+        if warm_future.done() and not warm_future.cancelled():
+            _, timings['warm'] = warm_future.result()
+        elif warm_future.cancel():
+            timings['warm'] = 'cancelled'
+        else:
+            timings['warm'] = 'unfinished'
+
+    def format_stage_timings(self, timings: Dict) -> Dict:
+        return {
+            stage: round(value * 1000, 1) if isinstance(value, float) else value
+            for stage, value in timings.items()
+        }
+
+    def process_query_with_timings(self, question: str, user_item: str) -> Tuple[str, Dict]:
+        """Answer the question and report per-stage wall times in milliseconds.
+
+        'context' overlaps 'table_info' and 'examples'; 'warm' is the
+        speculative read that overlaps 'generate' and is only a number if it
+        finished before 'execute' started.
+        """
+        timings = {}
+        response = self.process_query(question, user_item, timings)
+        return response, self.format_stage_timings(timings)
+
+    def process_query(self, question: str, user_item: str, timings: Optional[Dict] = None) -> str:
+        if timings is None:
+            timings = {}
+        warm_future = None
+        query_start = time.perf_counter()
         try:
-            collection_info = self.get_table_info(user_item)
             collection_name = self.config.SOURCE_COLLECTION_NAME
 
+            # User context fetch and example selection are independent, so
+            # run them side by side; example selection stays on this thread.
+            context_start = time.perf_counter()
+            table_info_future = self._submit_stage(self.get_table_info, user_item)
+            examples, timings['examples'] = self._run_stage(self.select_examples, question)
+            if table_info_future is None:
+                collection_info, timings['table_info'] = self._run_stage(self.get_table_info, user_item)
+            else:
+                collection_info, timings['table_info'] = table_info_future.result()
+            timings['context'] = time.perf_counter() - context_start
+
             # print("collection_info: ", collection_info, '\n')
             # print("collection_name: ", collection_name, '\n')
-            # print("self.get_collection_details(): ", self.get_collection_details(), '\n')
+            # print("self.fields_description: ", self.fields_description, '\n')
 
             # print("---"*20)
-            final_chain = (
-                {
-                    'examples': RunnableLambda(lambda x: self.few_shot_prompt.format(input=x["question"])),
-                    'question': itemgetter("question"), 
-                    'collection_name': RunnableLambda(lambda x: collection_name), 
-                    'fields_description': RunnableLambda(lambda x: self.get_collection_details()),
-                    "collection_info": RunnableLambda(lambda x: collection_info),
-                    "user_item": itemgetter("user_item")
-                }
-                | self.generate_query_prompt
-                | self.llm
-                | StrOutputParser()
-                | RunnableLambda(self.query_parser)
-            )
-            
-            generated_query = final_chain.invoke({'question': question, 'user_item': user_item})
+            generate_chain = self.generate_query_prompt | self.llm | StrOutputParser()
+
+            (generated_text, warm_future), timings['generate'] = self._run_stage(self._generate, generate_chain, {
+                'examples': examples,
+                'question': question,
+                'collection_name': collection_name,
+                'fields_description': self.fields_description,
+                'collection_info': collection_info,
+            }, user_item)
+            generated_query = self.query_parser(generated_text)
             # print("Generated prompt before user filter:", generated_query)
             
             validation_result = self.validate_mongo_query(generated_query)
             
             if validation_result == 2:
+                # The generation prompt already answers general questions, so
+                # reuse its output rather than asking the LLM a second time.
                 if isinstance(generated_query, dict) and 'response' in generated_query:
                     return generated_query['response']
-                else:
-                    chat_response = self.chat_prompt | self.llm | StrOutputParser()
-                    return chat_response.invoke({'question': question})
+                if isinstance(generated_query, str):
+                    return generated_query
+                return "This is out of my capabilities. You can ask questions about the transaction history."
             
             elif validation_result == 0:
                 return "I don't have access to modify the data. You can ask other questions about your transactions."
@@ -543,12 +620,13 @@ Response:"""
             # print("Query with user filter:", query_with_filter)
             
             # Execute the MongoDB query
-            mongo_response = self.execute_query(query_with_filter)
+            self._record_warm(timings, warm_future)
+            mongo_response, timings['execute'] = self._run_stage(self.execute_query, query_with_filter)
             # print("Mongo response:", mongo_response)
             
-            response = self.rephrase_answer.invoke({
+            response, timings['answer'] = self._run_stage(self.rephrase_answer.invoke, {
                 'question': question,
-                'fields_description': self.get_collection_details(),
+                'fields_description': self.fields_description,
                 'result': mongo_response
             })
             
@@ -560,7 +638,14 @@ Response:"""
         except Exception as e:
             print(f"Error in process_query: {e}")
             return f"An error occurred while processing your query: {str(e)}"
+        
+        finally:
+            # The warm-up is speculative; never let it outlive the query
+            self._record_warm(timings, warm_future)
+            timings['total'] = time.perf_counter() - query_start
     
     def close_connection(self):
+        self.stage_executor.shutdown(wait=True, cancel_futures=True)
+        self.warm_executor.shutdown(wait=True, cancel_futures=True)
         self.source_client.close()
 
@@ -36,11 +36,12 @@ def process_query():
         return jsonify({'error': 'Item cannot be empty'}), 400
     
     try:
-        response = mongo_agent.process_query(question, item)
+        response, stage_timings = mongo_agent.process_query_with_timings(question, item)
         return jsonify({
             'question': question,
             'item': item,
             'response_after': response,
+            'stage_timings_ms': stage_timings,
         }), 200
     
     except Exception as e:
@@ -12,3 +12,10 @@ class Config:
     
     MODEL_NAME = 'gemini-2.0-flash'
     EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+    
+    # Each in-flight query borrows one stage worker for its table info fetch.
+    # Size this to the number of concurrent requests the server handles; once
+    # all workers are busy the fetch runs inline, losing the overlap but never
+    # queueing behind other requests.
+    STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "16"))
+    WARM_WORKERS = int(os.getenv("WARM_WORKERS", "2"))